@@ -0,0 +1,22 @@
+import os
+
+from hatchling.builders.hooks.plugin.interface import BuildHookInterface
+
+
+class CustomBuildHook(BuildHookInterface):
+    """
+    Warn when the bundled zipcodes database (``zipch/_data.py``) hasn't been
+    generated. The package is then built without it, and the database is
+    downloaded at runtime instead.
+    """
+
+    def initialize(self, version, build_data):
+        if version == "editable":
+            return
+
+        if not os.path.exists(os.path.join(self.root, "zipch", "_data.py")):
+            self.app.display_warning(
+                "zipch/_data.py doesn't exist, the package will be built without"
+                " the bundled zipcodes database. Run `python tools/build_data.py`"
+                " to generate it."
+            )
@@ -0,0 +1,59 @@
+"""
+Generate the ``zipch/_data.py`` module, containing the zipcodes database as a
+Python literal so that it doesn't need to be downloaded and parsed at runtime.
+
+Usage: ``python tools/build_data.py [CSV_FILE]``. If no CSV file is given, the
+latest version of the zipcodes database is downloaded.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from zipch.zipcodes import ZipcodesDatabase  # NOQA
+
+DATA_MODULE_PATH = os.path.join(ROOT_DIR, "zipch", "_data.py")
+
+HEADER = """\
+# This file is generated by tools/build_data.py, don't edit it manually.
+from .zipcodes import Location, Lv95Coordinates
+
+MAPPING = {
+"""
+
+
+def build_data(csv_path, destination=DATA_MODULE_PATH):
+    """
+    Parse the ``csv_path`` zipcodes file and write it as a Python module to
+    ``destination``.
+    """
+    # Parse the file directly, to avoid leaving a cache file next to it
+    zipcode_mapping = ZipcodesDatabase(csv_path)._parse_csv()
+
+    with open(destination, "w", encoding="utf-8") as data_file:
+        data_file.write(HEADER)
+        for zipcode, location in zipcode_mapping.items():
+            data_file.write(
+                f"    {zipcode!r}: Location({location.official_name!r}, "
+                f"{location.canton!r}, {location.municipality!r}, "
+                f"Lv95Coordinates({location.coordinates.E!r}, "
+                f"{location.coordinates.N!r})),\n"
+            )
+        data_file.write("}\n")
+
+
+def main(argv):
+    if len(argv) > 1:
+        build_data(argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, "zipcodes.csv")
+            ZipcodesDatabase(csv_path).download()
+            build_data(csv_path)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1 +1,7 @@
-from .zipcodes import ZipcodesDatabase, lv95_to_wgs84  # NOQA
+from .zipcodes import (  # NOQA
+    ZipcodesDatabase,
+    get_database,
+    get_location,
+    lv95_to_wgs84,
+    lv95_to_wgs84_batch,
+)
@@ -1,26 +1,82 @@
+import array
+import collections
 import csv
 import dataclasses
-import decimal
+import functools
+import gzip
+import io
+import marshal
+import operator
 import os
-import tempfile
+import shutil
+import stat
+import sys
+import threading
 import zipfile
-from urllib.request import urlretrieve
+from urllib.request import Request, urlopen
+
+try:
+    import pyarrow
+    from pyarrow import csv as pyarrow_csv
+except ImportError:
+    pyarrow = None
+
+
+def _user_cache_dir():
+    """
+    Return the directory where zipch stores its files for the current user. It
+    must not be shared with other users, since the cache file next to the CSV
+    file is trusted.
+    """
+    if sys.platform == "win32":
+        base_dir = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base_dir = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+    else:
+        base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+
+    return os.path.join(base_dir, "zipch")
+
+
+DEFAULT_FILE_PATH = os.path.join(_user_cache_dir(), "zipcodes.csv")
+
+
+def _is_private_file(file_stat):
+    """
+    Return ``True`` if the file described by ``file_stat`` is owned by the
+    current user and can't be written by other users. File ownership isn't
+    checked on platforms without :func:`os.getuid` (ie. Windows).
+    """
+    if not hasattr(os, "getuid"):
+        return True
+
+    return file_stat.st_uid == os.getuid() and not (
+        file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+    )
 
 
 @dataclasses.dataclass
 class Wgs84Coordinates:
-    longitude: decimal.Decimal
-    latitude: decimal.Decimal
+    __slots__ = ("longitude", "latitude")
+
+    longitude: float
+    latitude: float
 
 
 @dataclasses.dataclass
 class Lv95Coordinates:
-    E: decimal.Decimal
-    N: decimal.Decimal
+    __slots__ = ("E", "N")
+
+    E: float
+    N: float
 
 
 @dataclasses.dataclass
 class Location:
+    __slots__ = ("official_name", "canton", "municipality", "coordinates")
+
     official_name: str
     canton: str
     municipality: str
@@ -31,40 +87,40 @@ def lv95_to_wgs84(lv95_coordinates: Lv95Coordinates) -> Wgs84Coordinates:
     """
     Based on https://www.swisstopo.admin.ch/content/swisstopo-internet/fr/topics/survey/reference-systems/switzerland/_jcr_content/contentPar/tabs/items/dokumente_publikatio/tabPar/downloadlist/downloadItems/516_1459343097192.download/ch1903wgs84_f.pdf
     """
+    longitude, latitude = lv95_to_wgs84_batch(
+        float(lv95_coordinates.E), float(lv95_coordinates.N)
+    )
+
+    return Wgs84Coordinates(longitude=longitude, latitude=latitude)
 
-    def d(number: str) -> decimal.Decimal:
-        return decimal.Decimal(number)
 
-    north = lv95_coordinates.N
-    east = lv95_coordinates.E
-    y = (east - 2600000) / 1000000
-    x = (north - 1200000) / 1000000
+def lv95_to_wgs84_batch(E, N):
+    """
+    Convert LV95 ``E`` and ``N`` coordinates to a ``(longitude, latitude)``
+    tuple. Only arithmetic operators are used, so ``E`` and ``N`` can either be
+    floats or NumPy arrays, in which case all the coordinates are converted in
+    a single vectorized pass.
+    """
+    y = (E - 2_600_000) / 1_000_000
+    x = (N - 1_200_000) / 1_000_000
+    y2 = y * y
 
     longitude = (
-        (
-            d("2.6779094")
-            + d("4.728982") * y
-            + d("0.791484") * y * x
-            + d("0.1306") * y * x ** 2
-            - d("0.0436") * y ** 3
-        )
+        (2.6779094 + y * (4.728982 + x * (0.791484 + 0.1306 * x) - 0.0436 * y2))
         * 100
         / 36
     )
     latitude = (
         (
-            d("16.9023892")
-            + d("3.238272") * x
-            - d("0.270978") * y ** 2
-            - d("0.002528") * x ** 2
-            - d("0.0447") * y ** 2 * x
-            - d("0.0140") * x ** 3
+            16.9023892
+            + x * (3.238272 - x * (0.002528 + 0.0140 * x))
+            - y2 * (0.270978 + 0.0447 * x)
         )
         * 100
         / 36
     )
 
-    return Wgs84Coordinates(longitude=longitude, latitude=latitude)
+    return longitude, latitude
 
 
 class ZipcodesDatabase:
@@ -77,10 +133,14 @@ class ZipcodesDatabase:
 
     Use it like this:
 
-        >>> zd = ZipcodesDatabase('/tmp/zipcodes')
+        >>> zd = ZipcodesDatabase('zipcodes.csv')
         >>> zd.get_location(1003)
         Location(official_name='Lausanne', canton='VD', municipality='Lausanne')
 
+    The database is loaded on the first query, which blocks until it's
+    downloaded and parsed. Use :meth:`preload_async` to load it in a
+    background thread instead, eg. when your application starts.
+
     The CSV file has the following fields, in this order:
 
     Ortschaftsname   nom officiel de la localité
@@ -102,15 +162,35 @@ class ZipcodesDatabase:
     """
 
     DOWNLOAD_URL = "https://data.geo.admin.ch/ch.swisstopo-vd.ortschaftenverzeichnis_plz/ortschaftenverzeichnis_plz/ortschaftenverzeichnis_plz_2056.csv.zip"  # NOQA
-
-    def __init__(self, file_path):
+    # Bump this whenever the structure of the cached rows changes, so that
+    # stale cache files get ignored
+    CACHE_VERSION = 5
+    # Columns read from the CSV file (looked up by name in its header), in this
+    # order
+    CSV_COLUMNS = ["PLZ", "Ortschaftsname", "Kantonskürzel", "Gemeindename", "E", "N"]
+
+    def __init__(self, file_path=None):
         """
         ``file_path`` is the path to the CSV file containing the zipcodes. You
         can put an inexistent file here, in which case the file will be
         downloaded from the internets.
+
+        If ``file_path`` is not set, the database bundled with the package is
+        used. If the package has been installed without it (eg. from a git
+        checkout), the zipcodes are downloaded to ``DEFAULT_FILE_PATH``, in the
+        current user's cache directory.
         """
-        self.file_path = file_path
+        self._use_bundled = file_path is None
+        self.file_path = DEFAULT_FILE_PATH if file_path is None else file_path
         self.zipcode_mapping = {}
+        self._zipcodes_by_canton = {}
+        self._zipcodes_by_municipality = {}
+        self._cantons = None
+        self._municipalities = None
+        # The mapping the indexes and `_lookup` have been built from
+        self._indexed_mapping = None
+        self._lookup = None
+        self._lock = threading.Lock()
 
     def download(self, overwrite=True):
         """
@@ -118,98 +198,322 @@ class ZipcodesDatabase:
         file won't be downloaded if it already exists.
         """
         if overwrite or not os.path.exists(self.file_path):
-            _, f = tempfile.mkstemp()
-            try:
-                urlretrieve(self.DOWNLOAD_URL, f)
-                extract_csv(f, self.file_path)
-            finally:
-                os.remove(f)
+            if self.file_path == DEFAULT_FILE_PATH:
+                os.makedirs(os.path.dirname(self.file_path), mode=0o700, exist_ok=True)
+
+            # urllib doesn't decode compressed responses, so only ask for gzip,
+            # which is handled below
+            request = Request(self.DOWNLOAD_URL, headers={"Accept-Encoding": "gzip"})
+            with urlopen(request) as response:
+                data = response.read()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    data = gzip.decompress(data)
+
+            extract_csv(io.BytesIO(data), self.file_path)
 
     def get_locations(self):
         """
         Return the zipcodes mapping as a list of ``{zipcode: location}`` dicts.
         The zipcodes file will be downloaded if necessary.
+
+        When no ``file_path`` has been given, a copy of the bundled database is
+        returned. The :class:`Location` objects in it are shared by all the
+        instances using the bundled database, so they shouldn't be modified.
+        Otherwise the parsed mapping is cached in a ``.cache`` file next to the
+        CSV file, so that the CSV file only needs to be parsed again when it
+        changes.
         """
-        if self.zipcode_mapping:
+        if self.zipcode_mapping and self.zipcode_mapping is self._indexed_mapping:
             return self.zipcode_mapping
 
-        self.download(overwrite=False)
+        # Make sure concurrent first calls (eg. with `preload_async`) only load
+        # the database once
+        with self._lock:
+            zipcode_mapping = self.zipcode_mapping or self._load()
+
+            # The mapping might have been set by the caller, in which case
+            # the indexes are built from it
+            if zipcode_mapping is not self._indexed_mapping:
+                self._build_indexes(zipcode_mapping)
+                # Used by `get_location` to skip the `get_locations` call once
+                # loaded
+                self._lookup = zipcode_mapping.__getitem__
+                self._indexed_mapping = zipcode_mapping
+            # Set last since it's what tells other threads the database is ready
+            self.zipcode_mapping = zipcode_mapping
+
+        return self.zipcode_mapping
+
+    def preload_async(self):
+        """
+        Load the zipcodes database in a background thread, so that the first
+        query doesn't block while it's downloaded and parsed. Return the
+        started :class:`threading.Thread`.
+        """
+        thread = threading.Thread(target=self.get_locations, daemon=True)
+        thread.start()
+
+        return thread
+
+    def _load(self):
+        """
+        Load the zipcodes mapping, either from the bundled database, the cache
+        file or the CSV file.
+        """
+        zipcode_mapping = self._load_bundled() if self._use_bundled else None
+        if zipcode_mapping is None:
+            self.download(overwrite=False)
+
+            # Stat the CSV file before reading it, so that a cache can't get
+            # the size and mtime of a file rewritten while it's being parsed
+            csv_stat = os.stat(self.file_path)
+            zipcode_mapping = self._load_cache(csv_stat)
+            if zipcode_mapping is None:
+                zipcode_mapping = self._parse_csv()
+                self._save_cache(zipcode_mapping, csv_stat)
+
+        return zipcode_mapping
+
+    def _load_bundled(self):
+        """
+        Return the zipcodes mapping bundled with the package, or ``None`` if
+        it's not available.
+        """
+        try:
+            from . import _data
+        except ImportError:
+            return None
+
+        return dict(_data.MAPPING)
+
+    def _build_indexes(self, zipcode_mapping):
+        """
+        Build the ``{canton: zipcodes}`` and ``{municipality: zipcodes}``
+        indexes used to look up zipcodes without scanning the whole mapping.
+        Zipcodes are stored as contiguous arrays of unsigned shorts (they
+        have four digits) rather than lists of int objects.
+        """
+        zipcodes_array = functools.partial(array.array, "H")
+        zipcodes_by_canton = collections.defaultdict(zipcodes_array)
+        zipcodes_by_municipality = collections.defaultdict(zipcodes_array)
+        for zipcode, location in zipcode_mapping.items():
+            zipcodes_by_canton[location.canton].append(zipcode)
+            zipcodes_by_municipality[location.municipality].append(zipcode)
+
+        self._zipcodes_by_canton = dict(zipcodes_by_canton)
+        self._zipcodes_by_municipality = dict(zipcodes_by_municipality)
+        self._cantons = None
+        self._municipalities = None
+
+    @property
+    def _cache_path(self):
+        return self.file_path + ".cache"
+
+    def _load_cache(self, csv_stat):
+        """
+        Return the zipcodes mapping stored in the cache file, or ``None`` if the
+        cache file doesn't exist, can't be read or was made from another
+        version of the CSV file than the one described by the ``csv_stat``
+        :func:`os.stat` result (as told by its size and modification time).
+
+        The cache only contains plain tuples, loaded with :mod:`marshal`, which
+        isn't safe against maliciously built data either. So cache files that
+        aren't owned by the current user, or that other users can write to, are
+        ignored.
+        """
+        try:
+            with open(self._cache_path, "rb") as cache_file:
+                if not _is_private_file(os.fstat(cache_file.fileno())):
+                    return None
+
+                version, csv_size, csv_mtime_ns, rows = marshal.load(cache_file)
+
+            if (version, csv_size, csv_mtime_ns) != (
+                self.CACHE_VERSION,
+                csv_stat.st_size,
+                csv_stat.st_mtime_ns,
+            ):
+                return None
+
+            return {
+                zipcode: Location(
+                    official_name, canton, municipality, Lv95Coordinates(east, north)
+                )
+                for zipcode, official_name, canton, municipality, east, north in rows
+            }
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
 
-        zipcode_mapping = {}
-        with open(self.file_path) as csv_file:
+    def _save_cache(self, zipcode_mapping, csv_stat):
+        """
+        Store the given zipcodes mapping in the cache file, along with the size
+        and modification time from ``csv_stat``, the :func:`os.stat` result of
+        the CSV file it was parsed from. Failing to write the cache file is not
+        an error, the CSV file will just be parsed again next time.
+        """
+        rows = tuple(
+            (
+                zipcode,
+                location.official_name,
+                location.canton,
+                location.municipality,
+                location.coordinates.E,
+                location.coordinates.N,
+            )
+            for zipcode, location in zipcode_mapping.items()
+        )
+        try:
+            with open(self._cache_path, "wb") as cache_file:
+                marshal.dump(
+                    (self.CACHE_VERSION, csv_stat.st_size, csv_stat.st_mtime_ns, rows),
+                    cache_file,
+                )
+        except OSError:
+            pass
+
+    def _parse_csv(self):
+        """
+        Parse the zipcodes CSV file and return it as a ``{zipcode: location}``
+        dict. The CSV file is parsed with pyarrow if it's installed, and with
+        the standard library :mod:`csv` module otherwise.
+
+        Canton and municipality names are interned, so that all the locations
+        of a canton or municipality share the same string.
+        """
+        if pyarrow is not None:
+            return self._parse_csv_pyarrow()
+
+        # Local names avoid global lookups in the loop below
+        location, coordinates = Location, Lv95Coordinates
+        intern = sys.intern
+        with open(self.file_path, encoding="utf-8-sig") as csv_file:
             csv_reader = csv.reader(csv_file, delimiter=";")
-            # Skip header
-            next(csv_reader)
-            for line in csv_reader:
-                zipcode_mapping[int(line[1])] = Location(
-                    official_name=line[0],
-                    canton=line[5],
-                    municipality=line[3],
-                    coordinates=Lv95Coordinates(
-                        E=decimal.Decimal(line[6]), N=decimal.Decimal(line[7])
-                    ),
+            header = next(csv_reader)
+            try:
+                get_columns = operator.itemgetter(
+                    *(header.index(column) for column in self.CSV_COLUMNS)
+                )
+            except ValueError:
+                raise LookupError(
+                    f"The CSV file header doesn't have all the {self.CSV_COLUMNS}"
+                    " columns"
+                ) from None
+
+            return {
+                int(zipcode): location(
+                    official_name,
+                    intern(canton),
+                    intern(municipality),
+                    coordinates(float(east), float(north)),
                 )
-        self.zipcode_mapping = zipcode_mapping
+                for zipcode, official_name, canton, municipality, east, north in map(
+                    get_columns, csv_reader
+                )
+            }
+
+    def _parse_csv_pyarrow(self):
+        table = pyarrow_csv.read_csv(
+            self.file_path,
+            parse_options=pyarrow_csv.ParseOptions(delimiter=";"),
+            convert_options=pyarrow_csv.ConvertOptions(
+                include_columns=self.CSV_COLUMNS,
+                column_types={
+                    "PLZ": pyarrow.int32(),
+                    "E": pyarrow.float64(),
+                    "N": pyarrow.float64(),
+                },
+            ),
+        )
 
-        return self.zipcode_mapping
+        return {
+            zipcode: Location(
+                official_name=official_name,
+                canton=sys.intern(canton),
+                municipality=sys.intern(municipality),
+                coordinates=Lv95Coordinates(E=east, N=north),
+            )
+            for zipcode, official_name, canton, municipality, east, north in zip(
+                *(table.column(column).to_pylist() for column in self.CSV_COLUMNS)
+            )
+        }
 
     def get_location(self, zipcode):
         """
-        Return the place name of the given zipcode. Raises :class:`IndexError`
+        Return the place name of the given zipcode. Raises :class:`KeyError`
         if the zipcode doesn't exist.
         """
-        return self.get_locations()[zipcode]
+        if self.zipcode_mapping is not self._indexed_mapping:
+            self.get_locations()
+
+        return self._lookup(zipcode)
 
     def get_zipcodes_for_municipality(self, municipality):
-        zipcodes = [
-            zipcode
-            for zipcode, location in self.get_locations().items()
-            if location.municipality == municipality
-        ]
+        self.get_locations()
+
+        zipcodes = self._zipcodes_by_municipality.get(municipality)
 
-        return zipcodes
+        return zipcodes.tolist() if zipcodes is not None else []
 
     def get_zipcodes_for_canton(self, canton):
         """
         Return the list of zipcodes for the given canton code.
         """
-        zipcodes = [
-            zipcode
-            for zipcode, location in self.get_locations().items()
-            if location.canton == canton
-        ]
+        self.get_locations()
+
+        zipcodes = self._zipcodes_by_canton.get(canton)
 
-        return zipcodes
+        return zipcodes.tolist() if zipcodes is not None else []
 
     def get_cantons(self):
         """
         Return the list of unique cantons, sorted by name.
         """
-        return sorted(
-            list(set([location.canton for location in self.get_locations().values()]))
-        )
+        self.get_locations()
+        if self._cantons is None:
+            self._cantons = tuple(sorted(self._zipcodes_by_canton))
+
+        return list(self._cantons)
 
     def get_municipalities(self):
         """
         Return the list of unique municipalities, sorted by name.
         """
-        return sorted(
-            list(
-                set(
-                    [
-                        location.municipality
-                        for location in self.get_locations().values()
-                    ]
-                )
-            )
-        )
+        self.get_locations()
+        if self._municipalities is None:
+            self._municipalities = tuple(sorted(self._zipcodes_by_municipality))
+
+        return list(self._municipalities)
+
+
+# Databases shared by the module-level helpers, by file path
+_databases = {}
+
+
+def get_database(file_path=None):
+    """
+    Return the :class:`ZipcodesDatabase` for the given ``file_path``
+    (``None`` being the bundled database), creating it on the first call. The
+    same instance is then returned for the whole process, so the database is
+    only loaded once.
+    """
+    try:
+        return _databases[file_path]
+    except KeyError:
+        return _databases.setdefault(file_path, ZipcodesDatabase(file_path))
+
+
+def get_location(zipcode, file_path=None):
+    """
+    Shortcut for ``get_database(file_path).get_location(zipcode)``.
+    """
+    return get_database(file_path).get_location(zipcode)
 
 
 def extract_csv(zip_path, destination):
     """
-    Extract the first CSV file found in the given ``zip_path`` ZIP file to the
-    ``destination`` file. Raises :class:`LookupError` if no CSV file can be
-    found in the ZIP.
+    Extract the first CSV file found in the given ``zip_path`` ZIP file (either
+    a path or a file object) to the ``destination`` file. Raises
+    :class:`LookupError` if no CSV file can be found in the ZIP.
     """
     with zipfile.ZipFile(zip_path) as zf:
         member_to_unzip = None
@@ -222,4 +526,4 @@ def extract_csv(zip_path, destination):
             raise LookupError("Couldn't find any CSV file in the archive")
 
         with zf.open(member_to_unzip) as zfp, open(destination, "wb") as dfp:
-            dfp.write(zfp.read())
+            shutil.copyfileobj(zfp, dfp, length=1024 * 1024)